@@ -0,0 +1,60 @@
+import torch
+import pytest
+
+from yogo.utils.prediction_formatting import PredictionLabelMatch
+
+
+# two classes plus background, so predictions have 5 + 2 elements
+NUM_CLASSES = 3
+
+PREDS = torch.tensor(
+    [
+        [0.1, 0.1, 0.2, 0.2, 0.9, 0.8, 0.2],
+        [0.5, 0.5, 0.6, 0.6, 0.7, 0.4, 0.6],
+    ]
+)
+LABELS = torch.tensor(
+    [
+        [1, 0.1, 0.1, 0.2, 0.2, 0],
+        [1, 0.5, 0.5, 0.6, 0.6, 1],
+    ]
+)
+
+MISSED_LABEL = torch.tensor([[1, 0.3, 0.3, 0.4, 0.4, 1]])
+EXTRA_PREDICTION = torch.tensor([[0.7, 0.7, 0.8, 0.8, 0.6, 0.3, 0.7]])
+
+# a missed label is a prediction of background, with objectness 1
+MISSED_LABEL_AS_PRED = torch.tensor([[0.3, 0.3, 0.4, 0.4, 1, 0, 0, 1]])
+# an extra prediction has a background label, and no background confidence
+EXTRA_PREDICTION_AS_PRED = torch.tensor([[0.7, 0.7, 0.8, 0.8, 0.6, 0.3, 0.7, 0]])
+EXTRA_PREDICTION_AS_LABEL = torch.tensor([[1, 0.7, 0.7, 0.8, 0.8, 2]])
+
+
+@pytest.mark.parametrize("has_missed", [False, True])
+@pytest.mark.parametrize("has_extra", [False, True])
+def test_convert_background_errors(has_missed: bool, has_extra: bool) -> None:
+    match = PredictionLabelMatch(
+        preds=PREDS,
+        labels=LABELS,
+        missed_labels=MISSED_LABEL if has_missed else None,
+        extra_predictions=EXTRA_PREDICTION if has_extra else None,
+    )
+
+    converted = match.convert_background_errors(NUM_CLASSES)
+
+    expected_preds = [torch.cat([PREDS, torch.zeros(2, 1)], dim=1)]
+    expected_labels = [LABELS]
+    if has_missed:
+        expected_preds.append(MISSED_LABEL_AS_PRED)
+        expected_labels.append(MISSED_LABEL)
+    if has_extra:
+        expected_preds.append(EXTRA_PREDICTION_AS_PRED)
+        expected_labels.append(EXTRA_PREDICTION_AS_LABEL)
+
+    torch.testing.assert_close(converted.preds, torch.cat(expected_preds))
+    torch.testing.assert_close(converted.labels, torch.cat(expected_labels))
+    assert converted.missed_labels is None
+    assert converted.extra_predictions is None
+
+    # the original match is left as it was
+    assert match.preds is PREDS
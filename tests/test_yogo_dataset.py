@@ -0,0 +1,200 @@
+import torch
+import pytest
+
+from pathlib import Path
+from typing import Tuple
+from torchvision.io import write_png
+
+from yogo.data.yogo_dataset import (
+    ObjectDetectionDataset,
+    load_labels,
+    label_file_to_tensor,
+)
+from yogo.data.yogo_dataloader import DevicePreloadedDataLoader
+
+
+CLASSES = ["you", "only", "glance", "once"]
+
+
+@pytest.fixture
+def dataset_dir(tmp_path: Path) -> Path:
+    "a tiny dataset of random 8-bit grayscale images, each with one label"
+    image_dir = tmp_path / "images"
+    label_dir = tmp_path / "labels"
+    image_dir.mkdir()
+    label_dir.mkdir()
+
+    for i in range(4):
+        img = torch.randint(0, 256, (1, 32, 48), dtype=torch.uint8)
+        write_png(img, str(image_dir / f"img_{i}.png"))
+        with open(label_dir / f"img_{i}.txt", "w") as f:
+            f.write(f"{i % len(CLASSES)},0.5,0.5,0.25,0.25\n")
+
+    return tmp_path
+
+
+def make_dataset(dataset_dir: Path, **kwargs) -> ObjectDetectionDataset:
+    return ObjectDetectionDataset(
+        dataset_dir / "images",
+        dataset_dir / "labels",
+        Sx=6,
+        Sy=4,
+        classes=CLASSES,
+        image_hw=(32, 48),
+        **kwargs,
+    )
+
+
+def get_sample(
+    dataset: ObjectDetectionDataset, index: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    sample = dataset[index]
+    assert sample is not None
+    return sample
+
+
+def test_cached_dataset_matches_uncached(dataset_dir: Path) -> None:
+    dataset = make_dataset(dataset_dir)
+    cached_dataset = make_dataset(dataset_dir, cache_images=True)
+
+    assert len(dataset) == len(cached_dataset) == 4
+
+    for i in range(len(dataset)):
+        img, labels = get_sample(dataset, i)
+        cached_img, cached_labels = get_sample(cached_dataset, i)
+        assert torch.equal(img, cached_img)
+        assert torch.equal(labels, cached_labels)
+
+
+def test_preloaded_labels_match_label_files(dataset_dir: Path) -> None:
+    dataset = make_dataset(dataset_dir)
+    expected_class_counts = torch.zeros(len(CLASSES), dtype=torch.long)
+    for i, label_path in enumerate(dataset._label_paths):
+        _, labels = get_sample(dataset, i)
+        expected = label_file_to_tensor(Path(label_path), 6, 4, CLASSES)
+        assert torch.equal(labels, expected)
+
+        class_idxs = load_labels(label_path, CLASSES)[:, 0].long()
+        expected_class_counts += torch.bincount(class_idxs, minlength=len(CLASSES))
+
+    assert torch.equal(dataset.calc_class_counts(), expected_class_counts)
+
+
+def test_negative_index(dataset_dir: Path) -> None:
+    dataset = make_dataset(dataset_dir)
+    img, labels = get_sample(dataset, -1)
+    last_img, last_labels = get_sample(dataset, len(dataset) - 1)
+    assert torch.equal(img, last_img)
+    assert torch.equal(labels, last_labels)
+
+    with pytest.raises(IndexError):
+        dataset[len(dataset)]
+
+
+def test_device_preloaded_dataloader(dataset_dir: Path) -> None:
+    dataset = make_dataset(dataset_dir)
+    loader = DevicePreloadedDataLoader.from_dataset(
+        dataset,
+        batch_size=3,
+        device="cpu",
+        augmentations=[],
+        rank=0,
+        world_size=1,
+    )
+
+    assert len(loader) == 2
+    assert len(loader.images) == len(loader.labels) == len(dataset)
+
+    batches = list(loader)
+    assert [imgs.shape[0] for imgs, _ in batches] == [3, 1]
+
+    # every sample should show up exactly once per epoch
+    all_imgs = torch.cat([imgs for imgs, _ in batches])
+    expected = torch.stack([get_sample(dataset, i)[0] for i in range(len(dataset))])
+    assert sorted(map(hash_tensor, all_imgs)) == sorted(map(hash_tensor, expected))
+
+
+def test_device_preloaded_dataloader_drop_last(dataset_dir: Path) -> None:
+    loader = DevicePreloadedDataLoader.from_dataset(
+        make_dataset(dataset_dir),
+        batch_size=3,
+        device="cpu",
+        augmentations=[],
+        rank=0,
+        world_size=1,
+        drop_last=True,
+    )
+
+    assert len(loader) == 1
+    assert [imgs.shape[0] for imgs, _ in loader] == [3]
+
+
+def hash_tensor(t: torch.Tensor) -> int:
+    return hash(t.numpy().tobytes())
+
+
+@pytest.mark.parametrize(
+    "file_contents",
+    [
+        "0,0.5,0.5,0.1,0.1\n2,0.2,0.3,0.1,0.2\n",
+        "class,xc,yc,w,h\n0,0.5,0.5,0.1,0.1\n2,0.2,0.3,0.1,0.2\n",
+        "0 0.5 0.5 0.1 0.1\n2 0.2 0.3 0.1 0.2\n",
+        "you,0.5,0.5,0.1,0.1\nglance,0.2,0.3,0.1,0.2\n",
+        "class xc yc w h\nyou 0.5 0.5 0.1 0.1\nglance 0.2 0.3 0.1 0.2\n",
+        '"you",0.5,0.5,0.1,0.1\n"glance",0.2,0.3,0.1,0.2\n',
+    ],
+)
+def test_load_labels(tmp_path: Path, file_contents: str) -> None:
+    label_path = tmp_path / "labels.txt"
+    label_path.write_text(file_contents)
+
+    labels = load_labels(
+        label_path,
+        CLASSES,
+        notes_data={
+            "categories": [{"id": i, "name": n} for i, n in enumerate(CLASSES)]
+        },
+    )
+
+    expected = torch.tensor([[0, 0.5, 0.5, 0.1, 0.1], [2, 0.2, 0.3, 0.1, 0.2]])
+    torch.testing.assert_close(labels, expected)
+
+
+def test_load_labels_single_row(tmp_path: Path) -> None:
+    label_path = tmp_path / "labels.txt"
+    label_path.write_text("1,0.5,0.5,0.1,0.1\n")
+    torch.testing.assert_close(
+        load_labels(label_path, CLASSES), torch.tensor([[1, 0.5, 0.5, 0.1, 0.1]])
+    )
+
+
+def test_headers_are_checked_per_file(dataset_dir: Path) -> None:
+    # the fixture's label files have a single row each, without a header
+    label_dir = dataset_dir / "labels"
+    (label_dir / "img_1.txt").write_text(
+        "class,xc,yc,w,h\n1,0.5,0.5,0.1,0.1\n2,0.2,0.3,0.1,0.2\n"
+    )
+    (label_dir / "img_2.txt").write_text(
+        "2,0.5,0.5,0.1,0.1\n2,0.2,0.3,0.1,0.2\n3,0.2,0.3,0.1,0.2\n"
+    )
+
+    dataset = make_dataset(dataset_dir)
+    assert dataset.calc_class_counts().tolist() == [1, 1, 3, 2]
+
+
+def test_load_labels_filters_tiny_boxes(tmp_path: Path) -> None:
+    label_path = tmp_path / "labels.txt"
+    label_path.write_text("0,0.5,0.5,0.1,0.1\n1,0.5,0.5,0.0001,0.0001\n")
+    assert load_labels(label_path, CLASSES).shape == (1, 5)
+
+
+def test_load_labels_empty(tmp_path: Path) -> None:
+    label_path = tmp_path / "labels.txt"
+    label_path.write_text("")
+    assert load_labels(label_path, CLASSES).shape == (0, 5)
+
+
+def test_missing_image(dataset_dir: Path) -> None:
+    (dataset_dir / "labels" / "img_no_image.txt").write_text("0,0.5,0.5,0.1,0.1\n")
+    with pytest.raises(FileNotFoundError):
+        make_dataset(dataset_dir)
@@ -1,4 +1,5 @@
 import os
+import math
 
 import torch
 import warnings
@@ -7,10 +8,26 @@ from tqdm import tqdm
 from functools import partial
 
 from torch.utils.data.distributed import DistributedSampler
-from torch.utils.data import Dataset, ConcatDataset, DataLoader, Subset, random_split
+from torch.utils.data import (
+    Dataset,
+    ConcatDataset,
+    DataLoader,
+    Subset,
+    TensorDataset,
+    random_split,
+)
 
 
-from typing import Any, List, Dict, Optional, Tuple, MutableMapping, Iterable, Union
+from typing import (
+    Any,
+    List,
+    Dict,
+    Optional,
+    Tuple,
+    MutableMapping,
+    Iterator,
+    Union,
+)
 
 from yogo.data.blobgen import BlobDataset
 from yogo.data.utils import collate_batch_robust
@@ -77,6 +94,7 @@ def get_datasets(
     image_hw: Tuple[int, int] = (772, 1032),
     normalize_images: bool = False,
     split_fraction_override: Optional[SplitFractions] = None,
+    cache_images: bool = False,
 ) -> MutableMapping[str, Dataset[Any]]:
     """
     The job of this function is to convert the dataset_definition_file to actual pytorch datasets.
@@ -93,6 +111,7 @@ def get_datasets(
             rgb=rgb,
             classes=dataset_definition.classes,
             normalize_images=normalize_images,
+            cache_images=cache_images,
         )
         for dsp in tqdm(dataset_definition.dataset_paths, desc="loading dataset")
     )
@@ -111,6 +130,7 @@ def get_datasets(
                 rgb=rgb,
                 classes=dataset_definition.classes,
                 normalize_images=normalize_images,
+                cache_images=cache_images,
             )
             for dsp in tqdm(
                 dataset_definition.test_dataset_paths, desc="loading test dataset"
@@ -179,6 +199,20 @@ def split_dataset(
     )
 
 
+def get_augmentations(training: bool = True) -> List[DualInputModule]:
+    """
+    The batch augmentations for the training set. These operate on whole batches, so
+    they can run either in the collate function or on-device after the H2D copy.
+    """
+    if not training:
+        return []
+
+    return [
+        RandomHorizontalFlipWithBBs(0.5),
+        RandomVerticalFlipWithBBs(0.5),
+    ]
+
+
 def get_dataloader(
     dataset_definition: DatasetDefinition,
     batch_size: int,
@@ -189,7 +223,15 @@ def get_dataloader(
     rgb: bool = False,
     normalize_images: bool = False,
     split_fraction_override: Optional[SplitFractions] = None,
-) -> Dict[str, DataLoader]:
+    cache_images: bool = False,
+    preload_device: Optional[Union[str, torch.device]] = None,
+) -> Dict[str, Union[DataLoader, "DevicePreloadedDataLoader"]]:
+    """
+    If `preload_device` is given, each dataset that comfortably fits on that device is
+    materialized there in full, and iterated over with a `DevicePreloadedDataLoader`
+    instead of a `DataLoader`. Note that this also freezes any thumbnail augmentation
+    (i.e. `BlobDataset`) samples for the whole run.
+    """
     split_datasets = get_datasets(
         dataset_definition,
         Sx,
@@ -198,16 +240,10 @@ def get_dataloader(
         image_hw=image_hw,
         normalize_images=normalize_images,
         split_fraction_override=split_fraction_override,
+        cache_images=cache_images,
     )
 
-    augmentations: List[DualInputModule] = (
-        [
-            RandomHorizontalFlipWithBBs(0.5),
-            RandomVerticalFlipWithBBs(0.5),
-        ]
-        if training
-        else []
-    )
+    augmentations = get_augmentations(training)
 
     # if ddp hasn't been initialized, these will raise a
     # RuntimeError instead of returning 0 and 1 respectively.
@@ -218,7 +254,7 @@ def get_dataloader(
         rank = 0
         world_size = 1
 
-    d = dict()
+    d: Dict[str, Union[DataLoader, DevicePreloadedDataLoader]] = dict()
     for designation, dataset in split_datasets.items():
         # catch case of len(dataset) == 0
         dataset_len = len(dataset)  # type: ignore
@@ -227,12 +263,36 @@ def get_dataloader(
 
         augs = augmentations if designation == "train" else []
 
+        # every rank has to use the same kind of loader, since otherwise they could
+        # run a different number of steps per epoch and hang in DDP's allreduce
+        if preload_device is not None and _on_all_ranks(
+            _fits_on_device(dataset, preload_device),
+            device=preload_device,
+            world_size=world_size,
+        ):
+            d[designation] = DevicePreloadedDataLoader.from_dataset(
+                dataset,
+                batch_size=batch_size,
+                device=preload_device,
+                augmentations=augs,
+                rank=rank,
+                world_size=world_size,
+                drop_last=designation == "train",
+            )
+            continue
+        elif preload_device is not None:
+            warnings.warn(
+                f"not preloading {designation} dataset onto {preload_device}; "
+                "falling back to a DataLoader"
+            )
+
         d[designation] = _get_dataloader(
             dataset,
             batch_size=batch_size,
             augmentations=augs,
             rank=rank,
             world_size=world_size,
+            drop_last=designation == "train",
         )
     return d
 
@@ -243,35 +303,259 @@ def _get_dataloader(
     augmentations: List[DualInputModule],
     rank: int,
     world_size: int,
+    drop_last: bool = False,
 ) -> DataLoader:
     transforms = MultiArgSequential(*augmentations)
 
-    sampler: Iterable = DistributedSampler(
-        dataset,
-        rank=rank,
-        num_replicas=world_size,
-    )
+    sampler = _get_sampler(dataset, rank=rank, world_size=world_size)
+    drop_last = _should_drop_last(drop_last, sampler, batch_size)
 
     # TODO this division by world_size is hacky. Starting up the dataloaders
     # are in*sane*ly slow. This helps reduce the problem, but tbh not by much
     dataset_len = len(dataset)  # type: ignore
     num_workers = max(1, choose_dataloader_num_workers(dataset_len) // world_size)
 
+    # pinned host memory is what makes `.to(device, non_blocking=True)` actually
+    # asynchronous; without a gpu it just costs page-locked memory, so skip it.
+    # prefetch_factor is kept at the default of 2 explicitly, since higher values
+    # can hold on to a lot of pinned memory per worker.
     return DataLoader(
         dataset,
         shuffle=False,
         sampler=sampler,
-        drop_last=False,
-        pin_memory=True,
+        drop_last=drop_last,
+        pin_memory=torch.cuda.is_available(),
         batch_size=batch_size,
         num_workers=num_workers,
         persistent_workers=num_workers > 0,
+        prefetch_factor=2,
         generator=torch.Generator().manual_seed(7271978),
         collate_fn=partial(collate_batch_robust, transforms=transforms),
         multiprocessing_context="spawn" if num_workers > 0 else None,
     )
 
 
+def _get_sampler(dataset: Dataset, rank: int, world_size: int) -> DistributedSampler:
+    # shuffles from its (fixed, default) seed and the epoch given to `set_epoch`
+    return DistributedSampler(
+        dataset,
+        rank=rank,
+        num_replicas=world_size,
+    )
+
+
+def _should_drop_last(
+    drop_last: bool, sampler: DistributedSampler, batch_size: int
+) -> bool:
+    # dropping the ragged last batch keeps every training step the same shape (which
+    # matters for `--compile`), but not if that would leave us with no batches at all
+    return drop_last and len(sampler) >= batch_size
+
+
+def _on_all_ranks(
+    flag: bool, device: Union[str, torch.device], world_size: int
+) -> bool:
+    "returns True only if `flag` is True on every rank"
+    if world_size == 1:
+        return flag
+
+    flag_tensor = torch.tensor(int(flag), device=device)
+    torch.distributed.all_reduce(flag_tensor, op=torch.distributed.ReduceOp.MIN)
+    return bool(flag_tensor.item())
+
+
+def _fits_on_device(
+    dataset: Dataset,
+    device: Union[str, torch.device],
+    max_fraction_of_free_memory: float = 0.5,
+) -> bool:
+    """
+    estimate the size of the materialized dataset from its first sample, and
+    check it against the free memory on the device, leaving plenty of room for
+    training itself. Non-cuda devices are assumed to fit.
+    """
+    device = torch.device(device)
+    if device.type != "cuda":
+        return True
+
+    sample = dataset[0]
+    if sample is None:
+        warnings.warn(
+            "could not read the first sample of the dataset, so its size can't be "
+            "estimated for preloading"
+        )
+        return False
+
+    sample_size = sum(t.nelement() * t.element_size() for t in sample)
+    free_memory, _ = torch.cuda.mem_get_info(device)
+    fits = sample_size * len(dataset) < max_fraction_of_free_memory * free_memory  # type: ignore
+    if not fits:
+        warnings.warn(f"dataset is too large to preload onto {device}")
+    return fits
+
+
+class DevicePreloadedDataLoader:
+    """
+    For datasets that are small enough, it is much faster to put every sample on
+    the device once and index into it than to run a DataLoader - no workers, no
+    collation, and no H2D copy per step. Sampling is done with a DistributedSampler
+    (for `set_epoch` and sharding across ranks), and augmentations are applied to
+    each batch, just as `_get_dataloader` does.
+    """
+
+    def __init__(
+        self,
+        images: torch.Tensor,
+        labels: torch.Tensor,
+        batch_size: int,
+        augmentations: List[DualInputModule],
+        rank: int,
+        world_size: int,
+        drop_last: bool = False,
+    ) -> None:
+        self.images = images
+        self.labels = labels
+        self.dataset: Dataset = TensorDataset(images, labels)
+        self.batch_size = batch_size
+        self.transforms = MultiArgSequential(*augmentations)
+        self.sampler = _get_sampler(self.dataset, rank=rank, world_size=world_size)
+        self.drop_last = _should_drop_last(drop_last, self.sampler, batch_size)
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset: Dataset,
+        batch_size: int,
+        device: Union[str, torch.device],
+        augmentations: List[DualInputModule],
+        rank: int,
+        world_size: int,
+        drop_last: bool = False,
+    ) -> "DevicePreloadedDataLoader":
+        dataset_len = len(dataset)  # type: ignore
+        # every rank preloads the whole dataset at once, so split the workers
+        # between them just as `_get_dataloader` does
+        num_workers = max(1, choose_dataloader_num_workers(dataset_len) // world_size)
+        loader = DataLoader(
+            dataset,
+            shuffle=False,
+            drop_last=False,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            collate_fn=collate_batch_robust,
+            multiprocessing_context="spawn" if num_workers > 0 else None,
+        )
+
+        # preallocate on-device, so we don't need the dataset on the host or
+        # twice on the device. Unreadable images are dropped by collate_batch_robust,
+        # so the final tensors can be a bit shorter than the dataset.
+        images: Optional[torch.Tensor] = None
+        labels: Optional[torch.Tensor] = None
+        n = 0
+        for imgs, lbls in tqdm(loader, desc=f"preloading dataset to {device}"):
+            if images is None or labels is None:
+                images = torch.empty(
+                    (dataset_len, *imgs.shape[1:]), dtype=imgs.dtype, device=device
+                )
+                labels = torch.empty(
+                    (dataset_len, *lbls.shape[1:]), dtype=lbls.dtype, device=device
+                )
+            images[n : n + len(imgs)] = imgs
+            labels[n : n + len(lbls)] = lbls
+            n += len(imgs)
+
+        if images is None or labels is None:
+            raise RuntimeError("could not read any samples from the dataset")
+
+        return cls(
+            images[:n],
+            labels[:n],
+            batch_size=batch_size,
+            augmentations=augmentations,
+            rank=rank,
+            world_size=world_size,
+            drop_last=drop_last,
+        )
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return math.ceil(len(self.sampler) / self.batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        idxs = torch.tensor(
+            list(self.sampler), dtype=torch.long, device=self.images.device
+        )
+        for batch_idxs in idxs.split(self.batch_size)[: len(self)]:
+            yield self.transforms(self.images[batch_idxs], self.labels[batch_idxs])
+
+
+class CUDAPrefetcher:
+    """
+    Wraps a dataloader so that the copy of the next batch to the device runs on a
+    side stream while the current batch is being used, instead of the copy and the
+    compute taking turns. The dataloader needs to give pinned memory for the copies
+    to actually run asynchronously. On non-cuda devices, this just moves each batch
+    to the device.
+    """
+
+    def __init__(
+        self,
+        loader: Union[DataLoader, "DevicePreloadedDataLoader"],
+        device: Union[str, torch.device],
+    ) -> None:
+        self.loader = loader
+        self.device = torch.device(device)
+        self.stream = (
+            torch.cuda.Stream(device=self.device)
+            if self.device.type == "cuda"
+            else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        if self.stream is None:
+            for imgs, labels in self.loader:
+                yield self._to_device(imgs, labels)
+            return
+
+        loader_iter = iter(self.loader)
+        next_batch = self._preload(loader_iter)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+
+            imgs, labels = next_batch
+            # these were allocated on the side stream, so let the caching allocator
+            # know that they're in use on the current stream too
+            imgs.record_stream(current_stream)  # type: ignore
+            labels.record_stream(current_stream)  # type: ignore
+
+            next_batch = self._preload(loader_iter)
+            yield imgs, labels
+
+    def _preload(
+        self, loader_iter: Iterator[Tuple[torch.Tensor, torch.Tensor]]
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        try:
+            imgs, labels = next(loader_iter)
+        except StopIteration:
+            return None
+
+        with torch.cuda.stream(self.stream):
+            return self._to_device(imgs, labels)
+
+    def _to_device(
+        self, imgs: torch.Tensor, labels: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        return (
+            imgs.to(self.device, non_blocking=True),
+            labels.to(self.device, non_blocking=True),
+        )
+
+
 DATALOADER_TYPES = Union[
     DataLoader[ConcatDataset[ObjectDetectionDataset]],
     DataLoader[Subset[ConcatDataset[ObjectDetectionDataset]]],
@@ -1,3 +1,4 @@
+import os
 import csv
 import json
 import torch
@@ -9,6 +10,7 @@ from torchvision.transforms import Resize
 
 from pathlib import Path
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Union, Tuple, Optional, Callable, Any, cast
 
 from yogo.data.utils import read_image_robust
@@ -69,45 +71,96 @@ def correct_label_idx(
         return classes.index(label)
 
 
+def sniff_label_delimiter(label_path: Union[str, Path]) -> Optional[str]:
+    "returns the delimiter of the label file, or None if it is empty"
+    with open(label_path, "r") as f:
+        return _sniff_label_delimiter(f.read(1024))
+
+
+def _sniff_label_delimiter(file_chunk: str) -> Optional[str]:
+    try:
+        return csv.Sniffer().sniff(file_chunk).delimiter
+    except csv.Error:
+        return None
+
+
+def _split_row(row: str, delimiter: str) -> List[str]:
+    # a whitespace delimiter means any amount of whitespace
+    fields = row.split(None if delimiter.isspace() else delimiter)
+    return [field.strip().strip('"') for field in fields]
+
+
+def _has_header(first_row: str, delimiter: str) -> bool:
+    # rows are [class, xc, yc, w, h]. The class can be a name, but xc is always a
+    # number, so that's enough to tell a header apart from a row of labels - no need
+    # for the (slow, and easily fooled by files with one row) Sniffer.has_header
+    fields = _split_row(first_row, delimiter)
+    return len(fields) > 1 and not _is_float(fields[1])
+
+
+def _is_float(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
 def load_labels(
-    label_path: Path,
+    label_path: Union[str, Path],
     classes: List[str],
     notes_data: Optional[Dict[str, Any]] = None,
-) -> List[List[float]]:
-    "loads labels from label file, given by image path"
-    labels: List[List[float]] = []
-
+    delimiter: Optional[str] = None,
+) -> torch.Tensor:
+    """
+    loads labels from label file into a tensor of shape (N, [class_idx, xc, yc, w, h]).
+    If delimiter is None, it is sniffed from the file itself. Whether the file has a
+    header is checked per file.
+    """
     with open(label_path, "r") as f:
-        file_chunk = f.read(1024)
-        f.seek(0)
+        file_contents = f.read()
 
-        try:
-            dialect = csv.Sniffer().sniff(file_chunk)
-            has_header = csv.Sniffer().has_header(file_chunk)
-            reader = csv.reader(f, dialect)
-        except csv.Error:
-            # empty file, no labels, just keep moving
-            return []
+    if delimiter is None:
+        delimiter = _sniff_label_delimiter(file_contents[:1024])
 
-        if has_header:
-            next(reader, None)
+    lines = [line for line in file_contents.splitlines() if line.strip()]
+    if delimiter is None or not lines:
+        # empty file, no labels, just keep moving
+        return torch.zeros(0, 5)
 
-        for row in reader:
-            assert (
-                len(row) == 5
-            ), f"should have [class,xc,yc,w,h] - got length {len(row)} {row}"
+    if _has_header(lines[0], delimiter):
+        lines = lines[1:]
 
-            xc, yc, w, h = map(float, row[1:])
+    if not lines:
+        return torch.zeros(0, 5)
 
-            if w * h < AREA_FILTER_THRESHOLD:
-                continue
+    # class labels can be indices or names, so read everything as strings
+    rows = np.loadtxt(
+        lines,
+        delimiter=None if delimiter.isspace() else delimiter,
+        quotechar='"',
+        dtype=str,
+        ndmin=2,
+    )
 
-            label_idx = correct_label_idx(row[0], classes, notes_data)
+    assert (
+        rows.shape[1] == 5
+    ), f"should have [class,xc,yc,w,h] - got {rows.shape[1]} columns"
 
-            # float for everything so we can make tensors of labels
-            labels.append([float(label_idx), xc, yc, w, h])
+    xcycwh = rows[:, 1:].astype(np.float64)
 
-    return labels
+    area_mask = xcycwh[:, 2] * xcycwh[:, 3] >= AREA_FILTER_THRESHOLD
+    rows, xcycwh = rows[area_mask], xcycwh[area_mask]
+
+    # only correct each distinct label once, instead of once per row
+    unique_labels, inverse = np.unique(np.char.strip(rows[:, 0]), return_inverse=True)
+    label_idxs = np.array(
+        [correct_label_idx(label, classes, notes_data) for label in unique_labels],
+        dtype=np.float64,
+    )[inverse]
+
+    # float for everything so we can make tensors of labels
+    return torch.from_numpy(np.column_stack((label_idxs, xcycwh))).float()
 
 
 def label_file_to_tensor(
@@ -116,16 +169,20 @@ def label_file_to_tensor(
     Sy: int,
     classes: List[str],
     notes_data: Optional[Dict[str, Any]] = None,
+    delimiter: Optional[str] = None,
 ) -> torch.Tensor:
     "loads labels from label file into a tensor suitible for back prop, given by image path"
 
     try:
-        labels = load_labels(label_path, classes=classes, notes_data=notes_data)
+        labels_tensor = load_labels(
+            label_path,
+            classes=classes,
+            notes_data=notes_data,
+            delimiter=delimiter,
+        )
     except Exception as e:
         raise RuntimeError(f"exception from {label_path}") from e
 
-    labels_tensor = torch.Tensor(labels)
-
     if labels_tensor.nelement() == 0:
         return torch.zeros(LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx)
 
@@ -146,6 +203,7 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         normalize_images: bool = False,
         extensions: Tuple[str, ...] = ("png", "jpg", "jpeg", "tif"),
         is_valid_file: Optional[Callable[[str], bool]] = None,
+        cache_images: bool = False,
         *args,
         **kwargs,
     ):
@@ -156,7 +214,9 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         self.classes = classes
         self.image_folder_path = image_folder_path
         self.label_folder_path = label_folder_path
+        self.rgb = rgb
         self.loader = partial(read_image_robust, retries=3, min_duration=0.1, rgb=rgb)
+        self.image_hw = tuple(image_hw)
         self.resize = Resize(image_hw, antialias=True)
         self.normalize_images = normalize_images
         self.notes_data: Optional[Dict[str, Any]] = None
@@ -178,6 +238,24 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         self._image_paths = np.array(image_paths).astype(np.unicode_)
         self._label_paths = np.array(label_paths).astype(np.unicode_)
 
+        # all label files in a dataset share a delimiter, so sniff it once here
+        # instead of for every label file that we load
+        self._label_delimiter: Optional[str] = next(
+            (
+                delimiter
+                for delimiter in map(sniff_label_delimiter, label_paths)
+                if delimiter is not None
+            ),
+            None,
+        )
+
+        self._labels, self._label_offsets = self._load_all_labels(label_paths)
+
+        self._image_cache: Optional[torch.Tensor] = None
+        self._image_cache_mask: Optional[torch.Tensor] = None
+        if cache_images:
+            self._cache_images()
+
     def make_dataset(
         self,
         Sx: int,
@@ -206,9 +284,14 @@ class ObjectDetectionDataset(datasets.VisionDataset):
             )
 
         if extensions is not None:
+            # same check as datasets.folder.has_file_allowed_extension, but with the
+            # extensions made into a tuple once instead of for every file
+            allowed_extensions = (
+                (extensions,) if isinstance(extensions, str) else tuple(extensions)
+            )
 
             def is_valid_file(x: str) -> bool:
-                return datasets.folder.has_file_allowed_extension(x, extensions)
+                return x.lower().endswith(allowed_extensions)
 
         is_valid_file = cast(Callable[[str], bool], is_valid_file)
 
@@ -221,27 +304,36 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         label_paths: List[str] = []
         missing_images: List[str] = []
 
-        for label_file_path in self.label_folder_path.glob("*.txt"):
-            # ignore (*nix convention) hidden files
-            if label_file_path.name.startswith("."):
-                continue
+        # list each directory once, instead of globbing the labels and then
+        # stat-ing every candidate image path; scandir doesn't stat entries
+        with os.scandir(self.image_folder_path) as image_entries:
+            image_file_names = {entry.name for entry in image_entries}
+
+        with os.scandir(self.label_folder_path) as label_entries:
+            label_file_names = [
+                entry.name
+                for entry in label_entries
+                # ignore (*nix convention) hidden files
+                if entry.name.endswith(".txt") and not entry.name.startswith(".")
+            ]
 
-            possible_image_paths = [
-                self.image_folder_path / label_file_path.with_suffix(sfx).name
-                for sfx in [".png", ".jpg"]
+        for label_file_name in label_file_names:
+            possible_image_names = [
+                label_file_name[: -len(".txt")] + sfx for sfx in [".png", ".jpg"]
             ]
 
             try:
                 image_file_path = next(
-                    ip
-                    for ip in possible_image_paths
-                    if (ip.exists() and is_valid_file(str(ip)))
+                    str(self.image_folder_path / name)
+                    for name in possible_image_names
+                    if name in image_file_names
+                    and is_valid_file(str(self.image_folder_path / name))
                 )
-                image_paths.append(str(image_file_path))
-                label_paths.append(str(label_file_path))
+                image_paths.append(image_file_path)
+                label_paths.append(str(self.label_folder_path / label_file_name))
             except StopIteration:
                 # image is missing
-                missing_images.append(str(label_file_path))
+                missing_images.append(str(self.label_folder_path / label_file_name))
                 if len(image_paths) > 10:
                     # just give up!
                     break
@@ -263,19 +355,92 @@ class ObjectDetectionDataset(datasets.VisionDataset):
 
         return image_paths, label_paths
 
-    def __getitem__(self, index: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
-        image_path = self._image_paths[index]
-        label_path = self._label_paths[index]
+    def _load_all_labels(
+        self, label_paths: List[str]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Load every label file once, into one tensor of shape (total number of labels,
+        [class_idx, x, y, x, y]), along with offsets such that the labels of sample i
+        are labels[offsets[i] : offsets[i + 1]]. A pair of flat tensors means that
+        there are no per-sample python objects to copy into the dataloader workers,
+        and that `__getitem__` doesn't have to open and parse a label file.
+        """
+        all_labels: List[torch.Tensor] = []
+        for label_path in label_paths:
+            try:
+                all_labels.append(
+                    load_labels(
+                        label_path,
+                        classes=self.classes,
+                        notes_data=self.notes_data,
+                        delimiter=self._label_delimiter,
+                    )
+                )
+            except Exception as e:
+                raise RuntimeError(f"exception from {label_path}") from e
+
+        offsets = torch.zeros(len(all_labels) + 1, dtype=torch.long)
+        offsets[1:] = torch.tensor([len(ls) for ls in all_labels]).cumsum(dim=0)
 
-        maybe_image = self.loader(image_path)
+        labels = torch.cat(all_labels) if all_labels else torch.zeros(0, 5)
+        labels[:, 1:] = ops.box_convert(labels[:, 1:], "cxcywh", "xyxy")
+
+        return labels, offsets
+
+    def _cache_images(self) -> None:
+        """
+        Decode (and resize) every image once into a single uint8 tensor in shared
+        memory, so `__getitem__` is just an index into it. The tensor is shared with
+        the dataloader workers instead of being copied, but it is one cache per
+        process, so it costs `len(self) * C * H * W` bytes of RAM per rank.
+        """
+        num_channels = 3 if self.rgb else 1
+        image_cache = torch.empty(
+            (len(self), num_channels, *self.image_hw), dtype=torch.uint8
+        ).share_memory_()
+        image_cache_mask = torch.zeros(len(self), dtype=torch.bool).share_memory_()
+
+        def cache_image(index: int) -> None:
+            image = self._read_image(index)
+            if image is not None:
+                image_cache[index] = image
+                image_cache_mask[index] = True
+
+        # decoding happens outside of the GIL, so threads are enough here
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(cache_image, range(len(self))))
+
+        self._image_cache = image_cache
+        self._image_cache_mask = image_cache_mask
+
+    def _load_image(self, index: int) -> Optional[torch.Tensor]:
+        if self._image_cache is not None and self._image_cache_mask is not None:
+            return self._image_cache[index] if self._image_cache_mask[index] else None
+        return self._read_image(index)
+
+    def _read_image(self, index: int) -> Optional[torch.Tensor]:
+        maybe_image = self.loader(self._image_paths[index])
         if maybe_image is None:
             return None
 
-        image = self.resize(maybe_image)
+        # most of our images are already at `image_hw`, so don't pay for an
+        # (antialiased) interpolation pass that would return the same image
+        if tuple(maybe_image.shape[-2:]) != self.image_hw:
+            return self.resize(maybe_image)
 
-        labels = label_file_to_tensor(
-            Path(label_path), self.Sx, self.Sy, self.classes, self.notes_data
-        )
+        return maybe_image
+
+    def __getitem__(self, index: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        # normalize negative indices (and raise IndexError for out of range ones),
+        # since label offsets are read as a pair at `index` and `index + 1`
+        index = range(len(self))[index]
+
+        image = self._load_image(index)
+        if image is None:
+            return None
+
+        start, end = self._label_offsets[index : index + 2].tolist()
+        labels = format_labels_tensor(self._labels[start:end], self.Sx, self.Sy)
 
         if self.normalize_images:
             # turns our torch.uint8 tensor 'sample' into a torch.FloatTensor
@@ -291,11 +456,4 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         returns a tensor of shape (num_classes,) where each index is the number of
         times that class appears in the dataset
         """
-        class_counts = torch.zeros(len(self.classes), dtype=torch.long)
-        for label_path in self._label_paths:
-            labels = load_labels(
-                label_path, classes=self.classes, notes_data=self.notes_data
-            )
-            for label in labels:
-                class_counts[int(label[0])] += 1
-        return class_counts
+        return torch.bincount(self._labels[:, 0].long(), minlength=len(self.classes))
@@ -125,20 +125,14 @@ class Metrics:
             ]
         )
 
-        def count_classes_in_tensor(class_predictions: torch.Tensor) -> torch.Tensor:
-            values, unique_counts = class_predictions.unique(return_counts=True)
-            final_counts = torch.zeros(self.num_classes, dtype=torch.long, device="cpu")
-            final_counts[values.long()] = unique_counts
-            return final_counts
-
         if pred_label_matches.missed_labels is not None:
-            self.num_obj_missed_by_class += count_classes_in_tensor(
-                pred_label_matches.missed_labels[:, 5].cpu()
+            self.num_obj_missed_by_class += self._count_classes(
+                pred_label_matches.missed_labels[:, 5]
             )
 
         if pred_label_matches.extra_predictions is not None:
-            self.num_obj_extra_by_class += count_classes_in_tensor(
-                pred_label_matches.extra_predictions[:, 5:].argmax(dim=1).cpu()
+            self.num_obj_extra_by_class += self._count_classes(
+                pred_label_matches.extra_predictions[:, 5:].argmax(dim=1)
             )
 
         self.total_num_true_objects += pred_label_matches.labels.shape[0]
@@ -153,8 +147,10 @@ class Metrics:
         if self.include_mAP:
             self.mAP.update(*self._format_for_mAP(fps, fls))
 
-        self.confusion.update(fps[:, 5:].argmax(dim=1), fls[:, 5:].squeeze())
-        self.prediction_metrics.update(fps[:, 5:], fls[:, 5:].squeeze().long())
+        # take the class columns once, instead of slicing + squeezing per metric
+        class_scores, class_labels = fps[:, 5:], fls[:, 5].long()
+        self.confusion.update(class_scores.argmax(dim=1), class_labels)
+        self.prediction_metrics.update(class_scores, class_labels)
 
     @torch.no_grad()
     def compute(self) -> Tuple[Any, ...]:
@@ -205,6 +201,13 @@ class Metrics:
         self.reset()
         return res
 
+    def _count_classes(self, class_predictions: torch.Tensor) -> torch.Tensor:
+        "number of times each class appears in class_predictions, as a cpu tensor"
+        # counted on cpu - see the note on the device-side assert in `__init__`
+        return torch.bincount(
+            class_predictions.long().cpu(), minlength=self.num_classes
+        )
+
     def _format_for_mAP(
         self, preds: torch.Tensor, labels: torch.Tensor
     ) -> Tuple[List[Dict[str, torch.Tensor]], List[Dict[str, torch.Tensor]]]:
@@ -214,21 +217,24 @@ class Metrics:
         formatted_labels
            tensor of labels shape=[N, mask x y x y class])
         """
-        formatted_preds, formatted_labels = [], []
-
-        for fp, fl in zip(preds, labels):
-            formatted_preds.append(
-                {
-                    "boxes": fp[:4].reshape(1, 4),
-                    "scores": fp[4].reshape(1),
-                    "labels": fp[5:].argmax().reshape(1),
-                }
-            )
-            formatted_labels.append(
-                {
-                    "boxes": fl[1:5].reshape(1, 4),
-                    "labels": fl[5].reshape(1).long(),
-                }
+        # every matched prediction / label pair is its own "image" for mAP, so we
+        # still need one dict per pair - but do the slicing for all pairs at once,
+        # and just take views of the results
+        pred_boxes = preds[:, :4].reshape(-1, 1, 4)
+        pred_scores = preds[:, 4].reshape(-1, 1)
+        pred_labels = preds[:, 5:].argmax(dim=1).reshape(-1, 1)
+        label_boxes = labels[:, 1:5].reshape(-1, 1, 4)
+        label_labels = labels[:, 5].long().reshape(-1, 1)
+
+        formatted_preds = [
+            {"boxes": boxes, "scores": scores, "labels": lbls}
+            for boxes, scores, lbls in zip(
+                pred_boxes.unbind(0), pred_scores.unbind(0), pred_labels.unbind(0)
             )
+        ]
+        formatted_labels = [
+            {"boxes": boxes, "labels": lbls}
+            for boxes, lbls in zip(label_boxes.unbind(0), label_labels.unbind(0))
+        ]
 
         return formatted_preds, formatted_labels
@@ -7,9 +7,9 @@ import torch
 import warnings
 
 from pathlib import Path
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import TypeAlias
-from typing import Any, Tuple, Optional, Collection, Union
+from typing import Any, Tuple, Optional, Callable, Collection, Union
 
 import torch.multiprocessing as mp
 
@@ -20,7 +20,13 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 
 from yogo.model import YOGO
 from yogo.metrics import Metrics
-from yogo.data.yogo_dataloader import get_dataloader
+from yogo.data.data_transforms import MultiArgSequential
+from yogo.data.yogo_dataloader import (
+    get_dataloader,
+    get_augmentations,
+    CUDAPrefetcher,
+    DevicePreloadedDataLoader,
+)
 from yogo.data.dataset_definition_file import DatasetDefinition
 from yogo.yogo_loss import YOGOLoss
 from yogo.model_defns import get_model_func
@@ -71,6 +77,9 @@ class Trainer:
 
         self._initialized = False
 
+        # for drawing the validation image off of the main thread
+        self._val_image_executor = ThreadPoolExecutor(max_workers=1)
+
     @classmethod
     def train_from_ddp(
         cls, _rank: int, _world_size: int, config: WandbConfig
@@ -157,8 +166,24 @@ class Trainer:
             backend="nccl", rank=self._rank, world_size=self._world_size
         )
 
+        # cuDNN's tensor core convolutions are fastest on NHWC ("channels_last")
+        # tensors, so keep the conv weights (and the images we feed it) in that layout
+        net.to(self.device, memory_format=torch.channels_last)
+
         self.net = DDP(net, device_ids=[self._rank])
 
+        # the compiled module shares its parameters with self.net, so checkpointing
+        # and loading state dicts still just go through self.net
+        self.compiled_net: Callable[[torch.Tensor], torch.Tensor] = self.net
+        if self.config["compile"] and hasattr(torch, "compile"):
+            # resize shape is fixed for the run, so specialize on it
+            self.compiled_net = torch.compile(self.net, dynamic=False)
+        elif self.config["compile"]:
+            warnings.warn(
+                f"torch.compile is not available in torch {torch.__version__}; "
+                "training without it"
+            )
+
     def _init_dataset(self) -> None:
         if self.Sx is None or self.Sy is None:
             raise RuntimeError("model not initialized")
@@ -170,20 +195,25 @@ class Trainer:
             self.config["batch_size"],
             Sx=self.Sx,
             Sy=self.Sy,
+            # the flip augmentations are applied to each batch on-device in `train`,
+            # which frees the dataloader workers up for decoding and resizing
+            training=False,
             image_hw=self.config["image_hw"],
             rgb=self.config["rgb"],
             normalize_images=self.config["normalize_images"],
             split_fraction_override=self.config["dataset_split_override"],
+            cache_images=self.config["cache_images"],
+            preload_device=self.device if self.config["preload_to_device"] else None,
         )
 
         train_dataloader = dataloaders["train"]
         # sneaky hack to replace non-existant datasets with empty list
-        validate_dataloader: Union[DataLoader[Any], Collection] = dataloaders.get(
-            "val", []
-        )
-        test_dataloader: Union[DataLoader[Any], Collection] = dataloaders.get(
-            "test", []
-        )
+        validate_dataloader: Union[
+            DataLoader[Any], DevicePreloadedDataLoader, Collection
+        ] = dataloaders.get("val", [])
+        test_dataloader: Union[
+            DataLoader[Any], DevicePreloadedDataLoader, Collection
+        ] = dataloaders.get("test", [])
 
         if self._dataset_size(validate_dataloader) == 0:
             warnings.warn("no validation dataset found")
@@ -196,15 +226,19 @@ class Trainer:
         self.test_dataloader = test_dataloader
 
     @staticmethod
-    def _dataset_size(dataloader: Union[Collection, DataLoader]) -> int:
+    def _dataset_size(
+        dataloader: Union[Collection, DataLoader, DevicePreloadedDataLoader]
+    ) -> int:
         # type ignore for dataset-sized type error
         return (
             len(dataloader.dataset)  # type: ignore
-            if isinstance(dataloader, DataLoader)
+            if isinstance(dataloader, (DataLoader, DevicePreloadedDataLoader))
             else len(dataloader)
         )
 
     def _init_training_tools(self) -> None:
+        self.augmentations = MultiArgSequential(*get_augmentations(training=True))
+
         self.Y_loss = YOGOLoss(
             no_obj_weight=self.config["no_obj_weight"],
             iou_weight=self.config["iou_weight"],
@@ -217,6 +251,10 @@ class Trainer:
             weight_decay=self.config["weight_decay"],
         )
 
+        # fp16 gradients can underflow to zero, so scale the loss up when training
+        # in half precision; this is a no-op if self.config["half"] is False
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.config["half"])
+
         self.scheduler = CosineAnnealingLR(
             self.optimizer,
             T_max=self.config["epochs"] * len(self.train_dataloader),
@@ -285,8 +323,8 @@ class Trainer:
                 "normalize_images": self.config["normalize_images"],
                 "classes": self.config["class_names"],
                 "model_name": model_name,
-                "model_state_dict": deepcopy(state_dict),
-                "optimizer_state_dict": deepcopy(self.optimizer.state_dict()),
+                "model_state_dict": state_dict,
+                "optimizer_state_dict": self.optimizer.state_dict(),
                 "model_version": model_version,
                 **kwargs,
             },
@@ -299,7 +337,13 @@ class Trainer:
         if not self._initialized:
             raise RuntimeError("trainer not initialized")
 
-        device = self.device
+        train_batches = CUDAPrefetcher(self.train_dataloader, self.device)
+
+        # calling `.item()` on the losses syncs with the gpu, so we keep a running sum
+        # of the losses on-device, and only log their mean every `log_interval` steps
+        log_interval = 100
+        running_losses = torch.zeros((), device=self.device)
+        steps_since_log = 0
 
         for epoch in range(self.config["epochs"]):
             self.epoch = epoch
@@ -307,9 +351,9 @@ class Trainer:
             self.train_dataloader.sampler.set_epoch(epoch)  # type: ignore
 
             self.net.train()
-            for imgs, labels in self.train_dataloader:
-                imgs = imgs.to(device, non_blocking=True)
-                labels = labels.to(device, non_blocking=True)
+            for imgs, labels in train_batches:
+                imgs, labels = self.augmentations(imgs, labels)
+                imgs = imgs.contiguous(memory_format=torch.channels_last)
 
                 self.optimizer.zero_grad(set_to_none=True)
 
@@ -317,27 +361,40 @@ class Trainer:
                     dtype=torch.float16,
                     enabled=self.config["half"],
                 ):
-                    outputs = self.net(imgs)
+                    outputs = self.compiled_net(imgs)
                     loss, loss_components = self.Y_loss(outputs, labels)
 
-                loss.backward()
+                self.scaler.scale(loss).backward()
 
-                self.optimizer.step()
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
                 self.scheduler.step()
 
                 self.global_step += 1
 
-                if self._rank == 0:
+                if self._rank != 0:
+                    continue
+
+                running_losses = (
+                    running_losses
+                    + torch.stack([loss.detach(), *loss_components.values()]).float()
+                )
+                steps_since_log += 1
+
+                if self.global_step % log_interval == 0:
+                    # one sync for all of the losses
+                    mean_losses = (running_losses / steps_since_log).tolist()
                     wandb.log(
                         {
-                            "train loss": loss.item(),
+                            "train loss": mean_losses[0],
                             "epoch": epoch,
                             "LR": self.scheduler.get_last_lr()[0],
-                            **loss_components,
+                            **dict(zip(loss_components.keys(), mean_losses[1:])),
                         },
-                        commit=self.global_step % 100 == 0,
                         step=self.global_step,
                     )
+                    running_losses = torch.zeros((), device=self.device)
+                    steps_since_log = 0
 
             if epoch % 4 == 0:
                 self._validate()
@@ -368,6 +425,8 @@ class Trainer:
                 "no test metrics found - most likely test_dataloader is empty"
             )
 
+        self._val_image_executor.shutdown()
+
         wandb.finish()
 
         torch.distributed.destroy_process_group()
@@ -384,14 +443,16 @@ class Trainer:
         val_loss = torch.tensor(0.0, device=device)
         # TODO figure out correct type for dataloader
         for imgs, labels in self.validate_dataloader:  # type: ignore
-            imgs = imgs.to(device, non_blocking=True)
+            imgs = imgs.to(device, non_blocking=True).contiguous(
+                memory_format=torch.channels_last
+            )
             labels = labels.to(device, non_blocking=True)
 
             with torch.cuda.amp.autocast(
                 dtype=torch.float16,
                 enabled=self.config["half"],
             ):
-                outputs = self.net(imgs)
+                outputs = self.compiled_net(imgs)
                 loss, _ = self.Y_loss(outputs, labels)
 
             val_loss += loss
@@ -406,26 +467,14 @@ class Trainer:
         if self._rank != 0:
             return
 
-        # just use the final imgs and labels for val!
-        annotated_img = wandb.Image(
-            draw_yogo_prediction(
-                imgs[0, ...],
-                outputs[0, ...].detach(),
-                labels=self.config["class_names"],
-                images_are_normalized=self.config["normalize_images"],
-            )
+        # just use the final imgs and labels for val! it's drawn on another thread,
+        # so that it overlaps with checkpointing below, and logged once that's done
+        annotated_img = self._val_image_executor.submit(
+            self._draw_validation_image, imgs[0, ...], outputs[0, ...].detach()
         )
 
         mean_val_loss = val_loss.item() / len(self.validate_dataloader)
 
-        wandb.log(
-            {
-                "validation bbs": annotated_img,
-                "val loss": mean_val_loss,
-            },
-            step=self.global_step,
-        )
-
         self.model_save_dir = Path(self._store.get("model_save_dir").decode("utf-8"))
         if mean_val_loss < self.min_val_loss:
             self.min_val_loss = mean_val_loss
@@ -444,10 +493,33 @@ class Trainer:
                 ),
             )
 
+        wandb.log(
+            {
+                "validation bbs": annotated_img.result(),
+                "val loss": mean_val_loss,
+            },
+            step=self.global_step,
+        )
+
+    def _draw_validation_image(
+        self, img: torch.Tensor, prediction: torch.Tensor
+    ) -> wandb.Image:
+        # the tensors are only copied to the cpu here, so the device -> host copy
+        # happens off of the main thread too. Those copies are new tensors already,
+        # so there's no need to clone.
+        return wandb.Image(
+            draw_yogo_prediction(
+                img.cpu(),
+                prediction.cpu(),
+                labels=self.config["class_names"],
+                images_are_normalized=self.config["normalize_images"],
+            )
+        )
+
     @staticmethod
     @torch.no_grad()
     def test(
-        test_dataloader: Union[Collection, DataLoader],
+        test_dataloader: Union[Collection, DataLoader, DevicePreloadedDataLoader],
         device: Union[str, torch.device],
         config: WandbConfig,
         net: torch.nn.Module,
@@ -632,6 +704,9 @@ def do_training(args) -> None:
         "pretrained_path": args.from_pretrained,
         "normalize_images": args.normalize_images,
         "dataset_split_override": args.dataset_split_override,
+        "cache_images": args.cache_images,
+        "preload_to_device": args.preload_to_device,
+        "compile": args.compile,
         "dataset_descriptor_file": args.dataset_descriptor_file,
         "slurm-job-id": os.getenv("SLURM_JOB_ID", default=None),
         "torch-version": torch.__version__,
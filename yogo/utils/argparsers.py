@@ -127,6 +127,25 @@ def train_parser(parser=None):
             "assigned to training, validation, and test."
         ),
     )
+    parser.add_argument(
+        "--cache-images",
+        default=False,
+        action=boolean_action,
+        help=(
+            "decode every image once and keep them all in RAM for the whole run - "
+            "only use this if the dataset (at --image-hw) fits in memory, once per gpu"
+        ),
+    )
+    parser.add_argument(
+        "--preload-to-device",
+        default=False,
+        action=boolean_action,
+        help=(
+            "load each dataset onto the gpu once, and skip the dataloader for it "
+            "entirely - only used for datasets under half of the free gpu memory. "
+            "Thumbnail augmentation samples are fixed for the run if this is set"
+        ),
+    )
     parser.add_argument(
         "-bs",
         "--batch-size",
@@ -218,6 +237,12 @@ def train_parser(parser=None):
         action=boolean_action,
         help="half precision (i.e. fp16) training. When true, try doubling your batch size to get best use of GPU",
     )
+    parser.add_argument(
+        "--compile",
+        default=False,
+        action=boolean_action,
+        help="compile the model with torch.compile (torch >= 2.0) - slower start-up, faster steps",
+    )
     parser.add_argument(
         "--device",
         type=str,
@@ -206,46 +206,59 @@ class PredictionLabelMatch:
     def convert_background_errors(self, num_classes: int) -> "PredictionLabelMatch":
         """
         Assumes that the ``background'' class is the last class
-        TODO right now we convert to list and back for mypy, but that's a bad tradeoff
-        and really we just need to figure out how to properly type this with torch
-        """
-        new_preds, new_labels = [], []
 
-        missed_labels = (
-            [] if self.missed_labels is None else self.missed_labels.tolist()
-        )
-        extra_predictions = (
-            [] if self.extra_predictions is None else self.extra_predictions.tolist()
-        )
+        Missed labels become predictions of background, and extra predictions
+        become labels of background. Both are built with a handful of batched
+        tensor ops, and concatenated onto preds and labels in a single `torch.cat`.
+        """
+        # add background class to end of self.preds too
+        new_preds = [
+            torch.cat(
+                [
+                    self.preds,
+                    torch.zeros(self.preds.shape[0], 1, device=self.preds.device),
+                ],
+                dim=1,
+            )
+        ]
+        new_labels = [self.labels]
 
-        for missed_label in missed_labels:
+        if self.missed_labels is not None:
+            missed_labels = self.missed_labels.to(self.preds.device, torch.float32)
+            # (x, y, x, y, objectness=1, one hot of background class)
+            background_preds = torch.zeros(
+                missed_labels.shape[0], 5 + num_classes, device=self.preds.device
+            )
+            background_preds[:, :4] = missed_labels[:, 1:5]
+            background_preds[:, 4] = 1
+            background_preds[:, -1] = 1
+            new_preds.append(background_preds)
+            new_labels.append(self.missed_labels.to(self.labels.device, torch.float32))
+
+        if self.extra_predictions is not None:
+            extra_predictions = self.extra_predictions.to(torch.float32)
+            # (mask=1, x, y, x, y, background class idx)
+            background_labels = torch.ones(
+                extra_predictions.shape[0], 6, device=self.labels.device
+            )
+            background_labels[:, 1:5] = extra_predictions[:, :4]
+            background_labels[:, 5] = num_classes - 1
             new_preds.append(
-                torch.tensor(
+                torch.cat(
                     [
-                        *missed_label[1:5],
-                        1,
-                        *one_hot(num_classes - 1, num_classes).float(),
-                    ]
+                        extra_predictions.to(self.preds.device),
+                        torch.zeros(
+                            extra_predictions.shape[0], 1, device=self.preds.device
+                        ),
+                    ],
+                    dim=1,
                 )
             )
-            new_labels.append(torch.tensor(missed_label))
-
-        for extra_prediction in extra_predictions:
-            new_preds.append(torch.tensor([*extra_prediction, 0]))  # add background
-            new_labels.append(torch.tensor([1, *extra_prediction[:4], num_classes - 1]))
-
-        new_preds_ten = torch.stack(new_preds).to(self.preds.device)
-        new_labels_ten = torch.stack(new_labels).to(self.labels.device)
-
-        # add background class to end of self.preds too
-        self.preds = torch.cat(
-            [self.preds, torch.zeros(self.preds.shape[0], 1, device=self.preds.device)],
-            dim=1,
-        )
+            new_labels.append(background_labels)
 
         return PredictionLabelMatch(
-            preds=torch.cat([self.preds, new_preds_ten]),
-            labels=torch.cat([self.labels, new_labels_ten]),
+            preds=torch.cat(new_preds),
+            labels=torch.cat(new_labels),
             missed_labels=None,
             extra_predictions=None,
         )
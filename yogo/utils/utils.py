@@ -228,29 +228,32 @@ def draw_yogo_prediction(
 
     num_channels, img_h, img_w = img.shape
 
-    formatted_rects: Union[torch.Tensor, List] = _format_tensor_for_rects(
+    # boxes are already scaled to pixels in one vectorized op, so pull them over to
+    # python in a single `.tolist()`, rather than indexing (and syncing on) each
+    # element of each box in the drawing loop below
+    formatted_rects: List[List[float]] = _format_tensor_for_rects(
         prediction,
         img_h=img_h,
         img_w=img_w,
         obj_thresh=obj_thresh,
         iou_thresh=iou_thresh,
         min_class_confidence_threshold=min_class_confidence_threshold,
-    )
+    ).tolist()
 
-    pil_img = transforms.ToPILImage()(img)
+    pil_img = transforms.ToPILImage()(img.cpu())
 
     rgb = PIL.Image.new("RGBA", pil_img.size)
     rgb.paste(pil_img)
     draw = PIL.ImageDraw.Draw(rgb)  # type: ignore
 
-    for r in formatted_rects:
-        r = list(r)
-        label_idx = int(r[4].item())
+    for x0, y0, x1, y1, label_idx_f, _ in formatted_rects:
+        label_idx = int(label_idx_f)
         label = labels[label_idx] if labels is not None else str(label_idx)
         draw.rectangle(
-            r[:4], outline=bbox_colour(label_idx, num_classes=num_channels - 5)
+            (x0, y0, x1, y1),
+            outline=bbox_colour(label_idx, num_classes=num_channels - 5),
         )
-        draw.text((r[0], r[1]), label, (0, 0, 0, 255), font_size=16)
+        draw.text((x0, y0), label, (0, 0, 0, 255), font_size=16)
 
     return rgb
 
@@ -37,7 +37,7 @@ class YOGOLoss(torch.nn.modules.loss._Loss):
 
     def forward(
         self, pred_batch: torch.Tensor, label_batch: torch.Tensor
-    ) -> Tuple[torch.Tensor, Dict[str, float]]:
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         """
         pred and label are both 4d. pred_batch has shape
         (
@@ -47,7 +47,9 @@ class YOGOLoss(torch.nn.modules.loss._Loss):
              Sy
         )
         We return both the total loss (which can be backpropped) and individual
-        loss components, which are useful for debugging.
+        loss components, which are useful for debugging. The components are left
+        as (detached) tensors on-device, since calling `.item()` on each of them
+        would sync with the device on every step.
         """
         batch_size, _, Sy, Sx = pred_batch.shape
 
@@ -121,9 +123,9 @@ class YOGOLoss(torch.nn.modules.loss._Loss):
         loss = objectness_loss + iou_loss + classification_loss
 
         loss_components = {
-            "iou_loss": iou_loss.item(),
-            "objectness_loss": objectness_loss.item(),
-            "classification_loss": classification_loss.item(),
+            "iou_loss": iou_loss.detach(),
+            "objectness_loss": objectness_loss.detach(),
+            "classification_loss": classification_loss.detach(),
         }
 
         return loss, loss_components